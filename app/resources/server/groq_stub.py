@@ -0,0 +1,114 @@
+# groq_stub.py
+#
+# Local stand-in for the Groq API that rate limits every third request (429 with retry-after),
+# for exercising the client-side limiter without a Groq account.
+#
+#   python groq_stub.py            serve on 127.0.0.1:8765; start server.py with GROQ_BASE_URL=http://127.0.0.1:8765
+#   python groq_stub.py --check    run ModelClient (sync and async, plain and streamed) against the stub
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RATE_LIMIT_EVERY = 3
+RETRY_AFTER_SECONDS = 1
+RESPONSE_TEXT = '{"files": []}'
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    calls = 0
+    rate_limited = 0
+    calls_lock = threading.Lock()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        with StubHandler.calls_lock:
+            StubHandler.calls += 1
+            limited = StubHandler.calls % RATE_LIMIT_EVERY == 1
+            if limited:
+                StubHandler.rate_limited += 1
+
+        if limited:
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                           {"retry-after": str(RETRY_AFTER_SECONDS)})
+        elif request.get("stream"):
+            self.send_stream()
+        else:
+            self.send_json(200, {
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": request.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": RESPONSE_TEXT}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self):
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("connection", "close")
+        self.end_headers()
+        middle = len(RESPONSE_TEXT) // 2
+        for piece in (RESPONSE_TEXT[:middle], RESPONSE_TEXT[middle:]):
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "stub",
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub(port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def check():
+    server = start_stub()
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    from src.modelclient import ModelClient
+
+    messages = [{"role": "user", "content": "ping"}]
+    deltas = []
+
+    async def on_token(delta):
+        deltas.append(delta)
+
+    async def run_async():
+        client = ModelClient(model="groq", async_mode=True, groq_api_key="stub")
+        results = await asyncio.gather(*(client.query_async(messages) for _ in range(4)))
+        results.append(await client.query_async(messages, on_token=on_token))
+        return results
+
+    sync_client = ModelClient(model="groq", async_mode=False, groq_api_key="stub")
+    results = [sync_client.query_sync(messages), sync_client.query_sync(messages, on_token=deltas.append)]
+    results += asyncio.run(run_async())
+
+    assert all(result == RESPONSE_TEXT for result in results), results
+    assert "".join(deltas) == RESPONSE_TEXT * 2, deltas
+    assert StubHandler.rate_limited > 0
+    print(f"ok: {len(results)} completions, {StubHandler.rate_limited} of {StubHandler.calls} stub calls rate limited and retried")
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        check()
+    else:
+        server = start_stub(8765)
+        print("Groq stub listening on http://127.0.0.1:8765")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
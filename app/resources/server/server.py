@@ -1,3 +1,4 @@
+import errno
 import shutil
 from pathlib import Path
 from typing import Optional, List, Union, AsyncGenerator
@@ -6,24 +7,21 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from src.loader import get_dir_summaries, summarize_single_document, master_summarize
 from src.tree_generator import create_file_tree
+from src.renamer import match_rule
+from src.staging import StagingStore, FileSummary
+from src.walk_filter import WalkFilter
 import uvicorn
 import os
 import asyncio
 import re
 from datetime import datetime
 import math
-import time
 import uuid
+import contextvars
+import logging
 
-from src.db import hash_file_contents, get_summary_from_db, store_summary_in_db, summaries_table, database
-
-# Logging function
-def log(text="", console_only=True):
-    if not console_only:
-        with open('./latest.log', 'a') as log_file:
-            timestamp = time.strftime("[%Y-%m-%d %H:%M:%S]")
-            log_file.write(f"{timestamp} {text}\n")
-    return
+from src.db import hash_file_contents, get_summary_by_hash, store_summary_in_db, summaries_table, database, search_summaries, index_file_path, move_indexed_path, remove_indexed_paths, needs_backfill, backfill_file_index
+from src.logger import log, start_logging, stop_logging, get_task_logs, current_task_id
 
 def format_mtime(mtime):
     return datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
@@ -42,11 +40,13 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup():
+    start_logging()
     await database.connect()
 
 @app.on_event("shutdown")
 async def shutdown():
     await database.disconnect()
+    stop_logging()
 
 @app.get("/")
 async def root():
@@ -58,8 +58,22 @@ class FilePathRequest(BaseModel):
     groq_api_key: str
     instruction: str
 
+class WalkOptions(BaseModel):
+    extensions: Optional[List[str]] = None  # e.g. [".pdf", ".txt"]
+    ignore_patterns: Optional[List[str]] = []  # .gitignore syntax, relative to the requested path
+    max_file_size: Optional[int] = None  # bytes
+    max_age_days: Optional[float] = None
+    follow_symlinks: Optional[bool] = False
+    cross_mounts: Optional[bool] = False
+
 class FolderContentsRequest(BaseModel):
     path: Optional[str] = None
+    filters: Optional[WalkOptions] = None
+
+class Rule(BaseModel):
+    pattern: str  # Extension (".pdf") or glob ("*invoice*", "scans/*.png")
+    folder: str
+    file_format: Optional[str] = None
 
 class Request(BaseModel):
     path: Optional[str] = None
@@ -69,13 +83,15 @@ class Request(BaseModel):
     file_format: Optional[str] = "{MONTH}_{DAY}_{YEAR}_{CONTENT}.{EXTENSION}"
     groq_api_key: Optional[str] = ""
     process_action: Optional[int] = 0  # 0 = move, 1 = duplicate
+    rules: Optional[List[Rule]] = []
+    filters: Optional[WalkOptions] = None
 
 def perform_action(src, dst, process_action):
     log(f"perform_action src: {src}")
     log(f"perform_action dst: {dst}")
     dst_directory = os.path.dirname(dst)
-    os.makedirs(dst_directory, exist_ok=True)
     try:
+        os.makedirs(dst_directory, exist_ok=True)
         if process_action == 0:  # Move
             if os.path.isfile(src) and os.path.isdir(dst):
                 shutil.move(src, os.path.join(dst, os.path.basename(src)))
@@ -98,10 +114,14 @@ def perform_action(src, dst, process_action):
                 detail=f"An error occurred while processing the resource: {e}"
             )
 
-async def async_scandir(path: str) -> AsyncGenerator:
+async def async_scandir(path: str, walk_filter: WalkFilter = None, rules=None) -> AsyncGenerator:
     loop = asyncio.get_event_loop()
     try:
-        entries = await loop.run_in_executor(None, lambda: list(os.scandir(path)))
+        # Filtering runs in the executor too, since it may stat every entry
+        entries = await loop.run_in_executor(None, lambda: [
+            entry for entry in os.scandir(path)
+            if walk_filter is None or walk_filter.include(entry, rules)
+        ])
         for entry in entries:
             yield entry
     except FileNotFoundError:
@@ -116,17 +136,31 @@ def format_size(bytes):
     i = int(math.floor(math.log(bytes, 1024)))
     return f"{round(bytes / math.pow(1024, i), 2)} {sizes[i]}"
 
-async def build_tree_structure(path, depth=0):
+async def build_tree_structure(path, depth=0, walk_filter=None, rules=None, backfill=None):
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail=f"Path does not exist: {path}")
 
+    # Listing is read-only, except for the one-time search index backfill of this folder
+    backfill_root = depth == 0 and await needs_backfill(path)
+    if backfill_root:
+        backfill = []
+
+    if walk_filter is None:
+        walk_filter = WalkFilter(path)
+    if not walk_filter.enter_directory(path):
+        return [], 0
+    rules = walk_filter.directory_rules(path, rules)
+
     entries = []
     total_size = 0
     try:
-        async for entry in async_scandir(path):
-            summary = await get_summary_from_db(entry.path.replace("\\", "/"))
+        async for entry in async_scandir(path, walk_filter, rules):
+            file_hash = await hash_file_contents(entry.path.replace("\\", "/"))
+            summary = await get_summary_by_hash(file_hash)
+            if summary and backfill is not None:
+                backfill.append((entry.path, file_hash))
             if entry.is_dir():
-                folder_contents, folder_size = await build_tree_structure(entry.path, depth + 1)
+                folder_contents, folder_size = await build_tree_structure(entry.path, depth + 1, walk_filter, rules, backfill)
                 entry_info = {
                     "name": entry.name.replace("\\", "/"),
                     "absolutePath": entry.path.replace("\\", "/"),
@@ -154,12 +188,15 @@ async def build_tree_structure(path, depth=0):
                 total_size += entry.stat().st_size
             entries.append(entry_info)
     except HTTPException as e:
-        log(f"Error while building tree structure: {e.detail}", console_only=True)
+        log(f"Error while building tree structure: {e.detail}", logging.ERROR)
         raise e
     except Exception as e:
-        log(f"Unexpected error: {e}", console_only=True)
+        log(f"Unexpected error: {e}", logging.ERROR)
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
+    if backfill_root:
+        await backfill_file_index(path, backfill)
+
     entries.sort(key=lambda x: not x['isDirectory'])
     return entries, total_size
 
@@ -208,7 +245,7 @@ async def summarize_document(request: FilePathRequest):
     file_hash = await hash_file_contents(file_path)
     file_type = os.path.splitext(file_path)[1][1:]
 
-    await store_summary_in_db(file_hash, file_type, summary)
+    await store_summary_in_db(file_hash, summary, file_path=file_path, file_type=file_type)
 
     return {"summary": summary}
 
@@ -224,8 +261,9 @@ async def batch_progress(websocket: WebSocket, task_id: str):
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        connections[task_id].remove(websocket)
-        if not connections[task_id]:
+        if websocket in connections.get(task_id, []):
+            connections[task_id].remove(websocket)
+        if task_id in connections and not connections[task_id]:
             del connections[task_id]
 
 @app.post("/batch")
@@ -237,6 +275,8 @@ async def batch(request: Request, background_tasks: BackgroundTasks):
     file_format = request.file_format
     groq_api_key = request.groq_api_key
     process_action = request.process_action
+    rules = [dict(rule) for rule in request.rules or []]
+    filters = dict(request.filters) if request.filters else None
 
     if not os.path.exists(path):
         raise HTTPException(status_code=400, detail="Path does not exist in filesystem")
@@ -244,76 +284,134 @@ async def batch(request: Request, background_tasks: BackgroundTasks):
     task_id = str(uuid.uuid4())
     connections[task_id] = []
 
-    background_tasks.add_task(process_batch, path, model, instruction, groq_api_key, process_action, max_tree_depth, file_format, task_id)
+    background_tasks.add_task(process_batch, path, model, instruction, groq_api_key, process_action, max_tree_depth, file_format, task_id, rules, filters)
 
     return {"task_id": task_id}
 
-async def notify_clients(task_id: str, message: dict):
+async def notify_clients(task_id: str, message: dict, best_effort: bool = False):
     if task_id in connections:
         websockets = connections[task_id]
-        for websocket in websockets:
-            await websocket.send_json(message)
-
-async def process_batch(path: str, model: str, instruction: str, groq_api_key: str, process_action: int, max_tree_depth: str, file_format: str, task_id: str):
+        for websocket in list(websockets):
+            if not best_effort:
+                await websocket.send_json(message)
+                continue
+            # High-frequency updates must not fail the batch; a subscriber that went away is dropped
+            try:
+                await websocket.send_json(message)
+            except Exception:
+                if websocket in websockets:
+                    websockets.remove(websocket)
+
+async def process_batch(path: str, model: str, instruction: str, groq_api_key: str, process_action: int, max_tree_depth: str, file_format: str, task_id: str, rules: list = None, filters: dict = None):
+    current_task_id.set(task_id)
     log("Reading files...")
-    summaries_dict = {}
-
-    async for update in get_dir_summaries(path, model, instruction, groq_api_key, notify_clients, task_id):
-        file_path = update["file_path"]
-        if file_path not in summaries_dict:
-            summaries_dict[file_path] = []
-        summaries_dict[file_path].append(update["summary"])
-
-    log("Summarizing files...")
-    final_summaries = []
-    dict_len = len(summaries_dict)
-    i = 0
-    for file_path, sub_summaries in summaries_dict.items():
-        # Check if summary exists in DB
-        existing_summary = await get_summary_from_db(file_path.replace("\\", "/"))
-        if existing_summary:
-            #log(f"existing summary utilized!")
-            final_summary = existing_summary
-        else:
-            if len(sub_summaries) == 1:
-                final_summary = sub_summaries[0]
-            else:
-                final_summary = await master_summarize(sub_summaries, model, instruction, groq_api_key)
-            
-            file_hash = await hash_file_contents(file_path)
-            await store_summary_in_db(file_hash, final_summary)
-        
-        final_summaries.append({"file_path": file_path, "summary": final_summary})
+    # Intermediate results are spilled to a temporary SQLite file instead of being kept in memory
+    staging = StagingStore()
+    try:
+        async for update in get_dir_summaries(path, model, instruction, groq_api_key, notify_clients, task_id, rules, filters):
+            staging.add_summary(update["file_path"], update["summary"])
+
+        log("Summarizing files...")
+        file_count = staging.file_count()
+
+        async def final_summaries():
+            i = 0
+            for file_path, sub_summaries in staging.iter_file_summaries():
+                if match_rule(rules, os.path.relpath(file_path, path)):
+                    # Placed by a user rule, no summary needed
+                    final_summary = ""
+                else:
+                    # Check if summary exists in DB
+                    file_hash = await hash_file_contents(file_path.replace("\\", "/"))
+                    existing_summary = await get_summary_by_hash(file_hash)
+                    if existing_summary:
+                        #log(f"existing summary utilized!")
+                        final_summary = existing_summary
+                        await index_file_path(file_path, file_hash)
+                    else:
+                        if len(sub_summaries) == 1:
+                            final_summary = sub_summaries[0]
+                        else:
+                            final_summary = await master_summarize(sub_summaries, model, instruction, groq_api_key)
+
+                        await store_summary_in_db(file_hash, final_summary, file_path=file_path)
+
+                await notify_clients(task_id, {"event": "progress", "type": 1, "progress": f"{i + 1}/{file_count}"})
+                i += 1
+                yield FileSummary(file_path, final_summary)
+
+        response_path = path
+        if process_action == 1:
+            response_path = generate_unique_path(path)
+
+        # Files are moved as soon as the planner streams out their destination,
+        # while the remaining batches are still being planned. The queue is bounded
+        # so planning waits for the mover rather than piling up entries.
+        loop = asyncio.get_event_loop()
+        pending_actions = asyncio.Queue(maxsize=256)
+
+        async def queue_action(file):
+            await pending_actions.put(file)
+
+        async def run_actions():
+            while (file := await pending_actions.get()) is not None:
+                full_original_path = path.replace("\\", "/") + ensure_beginning_slash(file["file_path"]).replace("\\", "/")
+                full_new_path = response_path.replace("\\", "/") + ensure_beginning_slash(file["new_path"]).replace("\\", "/")
+
+                # Executor threads don't inherit the context, so carry the task id across
+                context = contextvars.copy_context()
+                try:
+                    await loop.run_in_executor(None, context.run, perform_action, full_original_path, full_new_path, process_action)
+                    await move_indexed_path(full_original_path, full_new_path, keep_source=process_action == 1)
+                except Exception as e:
+                    # Keep draining the queue so the planner is never left waiting on a dead mover
+                    log(f"Could not move {full_original_path}: {getattr(e, 'detail', e)}", logging.ERROR)
+
+        log("Organizing files...")
+        actions = asyncio.create_task(run_actions())
+        try:
+            await create_file_tree(path, final_summaries(), model, instruction, max_tree_depth, file_format, groq_api_key, notify_clients, task_id, on_file=queue_action, rules=rules, dest_root=response_path, total_files=file_count, staging=staging)
+        finally:
+            await pending_actions.put(None)
+
+        log("Storing results...")
+        await actions
+    finally:
+        staging.close()
 
-        await notify_clients(task_id, {"event": "progress", "type": 1, "progress": f"{i + 1}/{dict_len}"})
-        i += 1
+    log("Preparing results for frontend...")
+    response, _ = await build_tree_structure(response_path, walk_filter=WalkFilter.from_options(response_path, filters))
+    await notify_clients(task_id, {"event": "complete", "data": response})
+    await notify_clients(task_id, {"event": "done"})
+    log("Request complete!")
 
-    log("Organizing files...")
-    files = await create_file_tree(path, final_summaries, model, instruction, max_tree_depth, file_format, groq_api_key, notify_clients, task_id)
+@app.get("/search")
+async def search(q: str, page: int = 1, page_size: int = 20, path: Optional[str] = None):
+    if page < 1 or not 1 <= page_size <= 100:
+        raise HTTPException(status_code=400, detail="page must be >= 1 and page_size between 1 and 100")
 
-    response_path = path
-    if process_action == 1:
-        response_path = generate_unique_path(path)
+    response = await search_summaries(q, limit=page_size, offset=(page - 1) * page_size, path_prefix=path)
 
-    log("Storing results...")
-    for file in files:
-        full_original_path = path.replace("\\", "/") + ensure_beginning_slash(file["file_path"]).replace("\\", "/")
-        full_new_path = response_path.replace("\\", "/") + ensure_beginning_slash(file["new_path"]).replace("\\", "/")
+    # Files moved or deleted outside of LlamaFS drop out of the index the first time they are hit
+    missing = [result["file_path"] for result in response["results"] if not os.path.exists(result["file_path"])]
+    if missing:
+        await remove_indexed_paths(missing)
+        response["results"] = [result for result in response["results"] if result["file_path"] not in missing]
+        response["total"] -= len(missing)
 
-        perform_action(full_original_path, full_new_path, process_action)
+    return {"query": q, "page": page, "page_size": page_size, **response}
 
-    log("Preparing results for frontend...")
-    response, _ = await build_tree_structure(response_path)
-    await notify_clients(task_id, {"event": "complete", "data": response})
-    await notify_clients(task_id, {"event": "done"})
-    log("Request complete!")
+@app.get("/tasks/{task_id}/logs")
+async def task_logs(task_id: str, limit: Optional[int] = None):
+    return {"task_id": task_id, "logs": get_task_logs(task_id, limit)}
 
 @app.post("/get-folder-contents")
 async def get_folder_contents(request: FolderContentsRequest):
     if not request.path or not os.path.exists(request.path):
         raise HTTPException(status_code=400, detail="Provided path does not exist")
     
-    response, _ = await build_tree_structure(request.path)
+    filters = dict(request.filters) if request.filters else None
+    response, _ = await build_tree_structure(request.path, walk_filter=WalkFilter.from_options(request.path, filters))
     unique_path = generate_unique_path(request.path)
     
     return {
@@ -40,7 +40,9 @@ async def hash_file_contents(file_path: str) -> str:
 
 async def get_summary_from_db(file_path: str) -> str:
     file_hash = await hash_file_contents(file_path)
+    return await get_summary_by_hash(file_hash)
 
+async def get_summary_by_hash(file_hash: str) -> str:
     if len(file_hash) > 0:
         query = summaries_table.select().where(summaries_table.c.file_hash == file_hash)
         result = await database.fetch_one(query)
@@ -49,15 +51,171 @@ async def get_summary_from_db(file_path: str) -> str:
 
     return ""
 
-async def store_summary_in_db(file_hash: str, summary: str):
+async def store_summary_in_db(file_hash: str, summary: str, file_path: str = None, file_type: str = None):
+    values = dict(file_hash=file_hash, summary=summary)
+    if file_type is not None:
+        values["file_type"] = file_type
     query = sqlalchemy.dialects.sqlite.insert(summaries_table).values(
-        file_hash=file_hash,
-        summary=summary
+        **values
     ).on_conflict_do_update(
         index_elements=['file_hash'],
         set_=dict(summary=summary)
     )
     await database.execute(query)
+    if file_path:
+        await index_file_path(file_path, file_hash)
+
+# Full-text search over summaries, by current file path.
+#
+# file_index maps each known path to the hash of its contents; summaries_fts holds one
+# row per path (same rowid as file_index) with that path's summary. The triggers keep
+# summaries_fts in sync whenever either a path or a summary changes.
+SEARCH_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS file_index (
+        id INTEGER PRIMARY KEY,
+        file_path TEXT NOT NULL UNIQUE,
+        file_hash TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS file_index_hash ON file_index (file_hash)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS summaries_fts USING fts5(file_path UNINDEXED, summary, tokenize = 'porter unicode61')",
+    """
+    CREATE TRIGGER IF NOT EXISTS file_index_insert AFTER INSERT ON file_index BEGIN
+        INSERT INTO summaries_fts (rowid, file_path, summary)
+        SELECT new.id, new.file_path, summary FROM summaries WHERE file_hash = new.file_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS file_index_delete AFTER DELETE ON file_index BEGIN
+        DELETE FROM summaries_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS file_index_update AFTER UPDATE ON file_index BEGIN
+        DELETE FROM summaries_fts WHERE rowid = old.id;
+        INSERT INTO summaries_fts (rowid, file_path, summary)
+        SELECT new.id, new.file_path, summary FROM summaries WHERE file_hash = new.file_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS summaries_insert AFTER INSERT ON summaries BEGIN
+        INSERT INTO summaries_fts (rowid, file_path, summary)
+        SELECT id, file_path, new.summary FROM file_index WHERE file_hash = new.file_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS summaries_update AFTER UPDATE OF summary ON summaries BEGIN
+        DELETE FROM summaries_fts WHERE rowid IN (SELECT id FROM file_index WHERE file_hash = new.file_hash);
+        INSERT INTO summaries_fts (rowid, file_path, summary)
+        SELECT id, file_path, new.summary FROM file_index WHERE file_hash = new.file_hash;
+    END
+    """,
+    # Summaries stored before the index existed carry no path, so they are backfilled from
+    # disk: search_state marks that a backfill is needed, file_index_backfill the folders done.
+    "CREATE TABLE IF NOT EXISTS search_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS file_index_backfill (root TEXT PRIMARY KEY)",
+]
+
+def normalize_index_path(file_path: str) -> str:
+    return file_path.replace("\\", "/")
+
+async def index_file_path(file_path: str, file_hash: str):
+    # The WHERE clause turns an unchanged mapping into a no-op, so no trigger fires.
+    await database.execute(
+        """
+        INSERT INTO file_index (file_path, file_hash) VALUES (:file_path, :file_hash)
+        ON CONFLICT (file_path) DO UPDATE SET file_hash = excluded.file_hash
+        WHERE file_index.file_hash != excluded.file_hash
+        """,
+        {"file_path": normalize_index_path(file_path), "file_hash": file_hash}
+    )
+
+async def needs_backfill(root: str) -> bool:
+    if not backfill_pending:
+        return False
+    root = normalize_index_path(root).rstrip("/")
+    done = await database.fetch_val(
+        "SELECT EXISTS (SELECT 1 FROM file_index_backfill WHERE root = :root OR substr(:root, 1, length(root) + 1) = root || '/')",
+        {"root": root}
+    )
+    return not done
+
+async def backfill_file_index(root: str, entries: list):
+    """Index the (file_path, file_hash) pairs found under root in one batch, once per folder."""
+    if entries:
+        await database.execute_many(
+            "INSERT INTO file_index (file_path, file_hash) VALUES (:file_path, :file_hash) ON CONFLICT (file_path) DO NOTHING",
+            [{"file_path": normalize_index_path(file_path), "file_hash": file_hash} for file_path, file_hash in entries]
+        )
+    await database.execute(
+        "INSERT OR IGNORE INTO file_index_backfill (root) VALUES (:root)",
+        {"root": normalize_index_path(root).rstrip("/")}
+    )
+
+async def move_indexed_path(src: str, dst: str, keep_source: bool = False):
+    """Point the index at a file's new location after a move, or add the copy after a duplicate."""
+    src, dst = normalize_index_path(src), normalize_index_path(dst)
+    if not keep_source:
+        await database.execute("DELETE FROM file_index WHERE file_path = :dst", {"dst": dst})
+        await database.execute("UPDATE file_index SET file_path = :dst WHERE file_path = :src", {"src": src, "dst": dst})
+    else:
+        await database.execute(
+            """
+            INSERT INTO file_index (file_path, file_hash)
+            SELECT :dst, file_hash FROM file_index WHERE file_path = :src
+            ON CONFLICT (file_path) DO UPDATE SET file_hash = excluded.file_hash
+            """,
+            {"src": src, "dst": dst}
+        )
+
+async def remove_indexed_paths(file_paths: list):
+    for file_path in file_paths:
+        await database.execute("DELETE FROM file_index WHERE file_path = :file_path", {"file_path": normalize_index_path(file_path)})
+
+def build_match_query(text: str) -> str:
+    # Quote every term so user input can't produce FTS5 syntax errors; the last term
+    # matches as a prefix so results show up while the user is still typing.
+    terms = [term.replace('"', '""') for term in text.split()]
+    if not terms:
+        return ""
+    return " ".join(f'"{term}"' for term in terms[:-1]) + (" " if len(terms) > 1 else "") + f'"{terms[-1]}"*'
+
+async def search_summaries(text: str, limit: int = 20, offset: int = 0, path_prefix: str = None) -> dict:
+    match_query = build_match_query(text)
+    if not match_query:
+        return {"total": 0, "results": []}
+
+    values = {"match_query": match_query}
+    path_filter = ""
+    if path_prefix:
+        # Escape LIKE wildcards, then restrict results to the folder
+        prefix = normalize_index_path(path_prefix).rstrip("/") + "/"
+        values["path_prefix"] = prefix.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+        path_filter = "AND file_path LIKE :path_prefix ESCAPE '!'"
+
+    total = await database.fetch_val(
+        f"SELECT count(*) FROM summaries_fts WHERE summaries_fts MATCH :match_query {path_filter}",
+        values
+    )
+    rows = await database.fetch_all(
+        f"""
+        SELECT file_path, snippet(summaries_fts, 1, '<mark>', '</mark>', '…', 16) AS snippet, rank
+        FROM summaries_fts WHERE summaries_fts MATCH :match_query {path_filter}
+        ORDER BY rank LIMIT :limit OFFSET :offset
+        """,
+        {**values, "limit": limit, "offset": offset}
+    )
+
+    results = [{"file_path": row["file_path"], "snippet": row["snippet"], "score": -row["rank"]} for row in rows]
+    return {"total": total, "results": results}
 
 engine = sqlalchemy.create_engine(DATABASE_URL)
 metadata.create_all(engine)
+with engine.begin() as connection:
+    creating_index = not sqlalchemy.inspect(connection).has_table("file_index")
+    for statement in SEARCH_SCHEMA:
+        connection.exec_driver_sql(statement)
+    if creating_index and connection.exec_driver_sql("SELECT EXISTS (SELECT 1 FROM summaries)").scalar():
+        connection.exec_driver_sql("INSERT OR REPLACE INTO search_state (key, value) VALUES ('backfill', 'pending')")
+    backfill_pending = connection.exec_driver_sql("SELECT EXISTS (SELECT 1 FROM search_state WHERE key = 'backfill')").scalar() == 1
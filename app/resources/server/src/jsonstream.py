@@ -0,0 +1,83 @@
+# jsonstream.py
+
+import json
+
+class JsonArrayStreamParser:
+    """
+    Incrementally scans streamed JSON text and returns each element of a top-level
+    array (by default the "files" list of the planner response) as soon as it is complete.
+
+    Text outside the outermost object (code fences, chatter) is ignored.
+    """
+
+    def __init__(self, key="files"):
+        self.key = key
+        self.buffer = ""
+        self.position = 0  # Next character of buffer to scan
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None  # Most recent complete string at depth 1, i.e. a candidate key
+        self.array_depth = None  # Depth inside the target array, once it has been entered
+        self.element_start = None
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        elements = []
+        buffer = self.buffer
+        i = self.position
+        while i < len(buffer):
+            char = buffer[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = buffer[self.string_start + 1:i]
+            elif char == '"':
+                if self.depth > 0:
+                    self.in_string = True
+                    self.string_start = i
+            elif char in "{[":
+                if char == "[" and self.depth == 1 and self.array_depth is None and self.last_string == self.key:
+                    self.array_depth = 2
+                elif char == "{" and self.depth == self.array_depth:
+                    self.element_start = i
+                self.depth += 1
+            elif char in "}]":
+                if self.depth == 0:
+                    i += 1
+                    continue
+                self.depth -= 1
+                if char == "}" and self.depth == self.array_depth and self.element_start is not None:
+                    try:
+                        elements.append(json.loads(buffer[self.element_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self.element_start = None
+                elif char == "]" and self.depth == 1 and self.array_depth == 2:
+                    self.array_depth = -1  # Array closed; ignore anything after it
+            i += 1
+        self.position = i
+        self._compact()
+        return elements
+
+    def _compact(self):
+        # Drop scanned text that no pending element or key still points into.
+        keep_from = self.position
+        if self.element_start is not None:
+            keep_from = min(keep_from, self.element_start)
+        if self.in_string and self.string_start is not None:
+            keep_from = min(keep_from, self.string_start)
+        if keep_from <= 0:
+            return
+        self.buffer = self.buffer[keep_from:]
+        self.position -= keep_from
+        if self.element_start is not None:
+            self.element_start -= keep_from
+        if self.string_start is not None:
+            self.string_start -= keep_from
@@ -9,17 +9,10 @@ from llama_index.core.schema import ImageDocument
 from llama_index.core.node_parser import TokenTextSplitter
 from termcolor import colored
 from .modelclient import ModelClient
-import time
 from .db import get_summary_from_db
-
-# Logging function
-def log(text="", console_only=True):
-    if not console_only:
-        # Write to the latest.log file
-        with open('./latest.log', 'a') as log_file:
-            timestamp = time.strftime("[%Y-%m-%d %H:%M:%S]")
-            log_file.write(f"{timestamp} {text}\n")
-    return
+from .logger import log
+from .renamer import match_rule
+from .walk_filter import WalkFilter
 
 async def master_summarize(sub_summaries: list, model: str, instruction: str, groq_api_key: str) -> str:
     client = ModelClient(model=model, async_mode=True, groq_api_key=groq_api_key)
@@ -51,11 +44,25 @@ async def master_summarize(sub_summaries: list, model: str, instruction: str, gr
     log("Master summary completed")
     return combined_summary
 
+DEFAULT_EXTENSIONS = [
+    ".pdf",
+    ".txt",
+    ".png",
+    ".jpg",
+    ".jpeg",
+]
+
 # @weave.op()
 # @agentops.record_function("summarize")
-async def get_dir_summaries(path: str, model: str, instruction: str, groq_api_key: str, notify_clients, task_id: str):
-    doc_dicts = load_documents(path)
-    async for summary in get_summaries(doc_dicts, model, instruction, groq_api_key, notify_clients, task_id):
+async def get_dir_summaries(path: str, model: str, instruction: str, groq_api_key: str, notify_clients, task_id: str, rules=None, filters=None):
+    # Files placed by a user rule never need a summary, so they are never read or parsed
+    def skip_file(file_path):
+        return match_rule(rules, os.path.relpath(file_path, path)) is not None
+
+    # The walk runs twice, once only to count, so no list of every path is kept in memory
+    file_count = sum(1 for _ in iter_input_files(path, filters))
+    doc_dicts = load_documents(path, iter_input_files(path, filters), skip_file)
+    async for summary in get_summaries(doc_dicts, model, instruction, groq_api_key, notify_clients, task_id, file_count):
         await notify_clients(task_id, {"event": "log", "message": f"Processed: {summary['file_path']}"})
         yield summary
     # [
@@ -70,34 +77,34 @@ async def get_dir_summaries(path: str, model: str, instruction: str, groq_api_ke
     #     }
     # ]
 
+def iter_input_files(path: str, filters=None):
+    # Pruning happens while walking, so ignored folders are never scanned or read
+    walk_filter = WalkFilter.from_options(path, filters, DEFAULT_EXTENSIONS, exclude_hidden=True)
+    return walk_filter.iter_files()
+
 # @weave.op()
 # @agentops.record_function("load")
-def load_documents(path: str):
-    reader = SimpleDirectoryReader(
-        input_dir=path,
-        recursive=True,
-        required_exts=[
-            ".pdf",
-            ".txt",
-            ".png",
-            ".jpg",
-            ".jpeg",
-        ],
-    )
+def load_documents(path: str, input_files=None, skip_file=None):
+    # Generator: each file gets its own reader and is read only when the summarizer asks for it
+    if input_files is None:
+        input_files = iter_input_files(path)
     splitter = TokenTextSplitter(chunk_size=6144)
-    documents = []
-    for docs in reader.iter_data():
-        if len(docs) > 1:
-            for d in docs:
-                contents = splitter.split_text("\n".join(d.text))
-                if len(contents) > 0:
-                    text = contents[0]
-                else:
-                    text = ""
-                documents.append(Document(text=text, metadata=docs[0].metadata))
-        else:
-            documents.append(docs[0])
-    return documents
+    for file_path in input_files:
+        if skip_file is not None and skip_file(file_path):
+            # Passed on without reading the file, so it still gets an (empty) summary and a place
+            yield Document(text="", metadata={"file_path": file_path, "skipped": True})
+            continue
+        for docs in SimpleDirectoryReader(input_files=[file_path]).iter_data():
+            if len(docs) > 1:
+                for d in docs:
+                    contents = splitter.split_text("\n".join(d.text))
+                    if len(contents) > 0:
+                        text = contents[0]
+                    else:
+                        text = ""
+                    yield Document(text=text, metadata=docs[0].metadata)
+            else:
+                yield docs[0]
 
 # @weave.op()
 # @agentops.record_function("metadata")
@@ -128,7 +135,7 @@ async def summarize_single_document(file_path: str, instruction: str, model: str
 
     return summary.get("summary", "")
 
-async def summarize_document(doc, client, instruction):
+async def summarize_document(doc, client, instruction, on_token=None):
 
     PROMPT = f"""
     You will be provided with the contents of a file along with its metadata. Provide a summary of the contents. The purpose of the summary is to organize files based on their content. To this end provide a concise but informative summary. Make the summary as specific to the file as possible.
@@ -143,7 +150,7 @@ async def summarize_document(doc, client, instruction):
     response = await client.query_async([
         {"role": "system", "content": PROMPT},
         {"role": "user", "content": json.dumps(doc)},
-    ])
+    ], on_token=on_token)
 
     if response is not None:
         summary = {
@@ -160,7 +167,7 @@ async def summarize_document(doc, client, instruction):
 
     return summary
 
-async def summarize_image_document(doc: ImageDocument, client, instruction):
+async def summarize_image_document(doc: ImageDocument, client, instruction, on_token=None):
 
     PROMPT = f"""
     Summarize the contents of this image.
@@ -179,7 +186,7 @@ async def summarize_image_document(doc: ImageDocument, client, instruction):
             "content": PROMPT,
             "images": [doc.image_path]
         }
-    ])
+    ], on_token=on_token)
 
     if response is not None:
         summary = {
@@ -196,7 +203,7 @@ async def summarize_image_document(doc: ImageDocument, client, instruction):
 
     return summary
 
-async def dispatch_summarize_document(doc, client, image_client, instruction):
+async def dispatch_summarize_document(doc, client, image_client, instruction, on_token=None):
     file_path = doc.metadata['file_path'] if isinstance(doc, Document) else doc.image_path
 
     existing_summary = await get_summary_from_db(file_path)
@@ -206,20 +213,40 @@ async def dispatch_summarize_document(doc, client, image_client, instruction):
         return {"file_path": file_path, "summary": ""} 
 
     if isinstance(doc, ImageDocument):
-        return await summarize_image_document(doc, image_client, instruction)
+        return await summarize_image_document(doc, image_client, instruction, on_token)
     elif isinstance(doc, Document):
-        return await summarize_document({"content": doc.text, **doc.metadata}, client, instruction)
+        return await summarize_document({"content": doc.text, **doc.metadata}, client, instruction, on_token)
     else:
         raise ValueError("Document type not supported")
     
-async def get_summaries(documents, model: str, instruction: str, groq_api_key: str, notify_clients, task_id: str):
+async def get_summaries(documents, model: str, instruction: str, groq_api_key: str, notify_clients, task_id: str, file_count=None):
     client = ModelClient(model=model, async_mode=True, groq_api_key=groq_api_key)
     image_client = ModelClient(model="moondream", async_mode=True)
 
-    documents_length = len(documents)
-
-    for i, doc in enumerate(documents):
-        summary = await dispatch_summarize_document(doc, client, image_client, instruction)
+    # documents may be a generator, so progress is counted in files, not documents
+    if file_count is None:
+        file_count = len(documents)
+    i = -1
+    previous_path = None
+
+    for doc in documents:
+        file_path = doc.metadata['file_path'] if isinstance(doc, Document) else doc.image_path
+        if file_path != previous_path:
+            i += 1
+            previous_path = file_path
+        documents_length = max(file_count, i + 1)
+
+        if doc.metadata.get("skipped"):
+            await notify_clients(task_id, {"event": "progress", "type": 0, "progress": f"{i + 1}/{documents_length}"})
+            yield {"file_path": file_path, "summary": ""}
+            continue
+
+        # Forward summary text to subscribers as the model produces it; best effort, so a
+        # subscriber disconnecting mid-stream does not fail the summary
+        async def forward_token(delta, file_path=file_path):
+            await notify_clients(task_id, {"event": "summary_delta", "file_path": file_path, "delta": delta}, best_effort=True)
+
+        summary = await dispatch_summarize_document(doc, client, image_client, instruction, forward_token)
         await notify_clients(task_id, {"event": "progress", "type": 0, "progress": f"{i + 1}/{documents_length}"})
         yield summary
         
@@ -0,0 +1,115 @@
+# logger.py
+
+import contextvars
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FILE = './latest.log'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+RING_BUFFER_SIZE = 1000  # Records kept in memory per task
+RING_BUFFER_TASKS = 100  # Tasks kept in memory before the oldest is dropped
+
+# Set once per batch; every log call made in that context is tagged with it
+current_task_id = contextvars.ContextVar("current_task_id", default=None)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record_to_dict(record), default=str)
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent records of each task in memory for /tasks/{id}/logs."""
+
+    def __init__(self, capacity=RING_BUFFER_SIZE, max_tasks=RING_BUFFER_TASKS):
+        super().__init__()
+        self.capacity = capacity
+        self.max_tasks = max_tasks
+        self.buffers = OrderedDict()
+        self.buffer_lock = threading.Lock()
+
+    def emit(self, record):
+        task_id = getattr(record, "task_id", None)
+        if task_id is None:
+            return
+        with self.buffer_lock:
+            if task_id not in self.buffers:
+                self.buffers[task_id] = deque(maxlen=self.capacity)
+                if len(self.buffers) > self.max_tasks:
+                    self.buffers.popitem(last=False)
+            self.buffers[task_id].append(record)
+
+    def get(self, task_id, limit=None):
+        with self.buffer_lock:
+            records = list(self.buffers.get(task_id, ()))
+        if limit is not None:
+            records = records[-limit:] if limit > 0 else []
+        return [record_to_dict(record) for record in records]
+
+class _InProcessQueueHandler(QueueHandler):
+    # Records never leave the process, so skip formatting them on the caller's thread.
+    def prepare(self, record):
+        return record
+
+def record_to_dict(record):
+    entry = {
+        "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+        "level": record.levelname,
+        "task_id": getattr(record, "task_id", None),
+        "message": record.getMessage(),
+    }
+    entry.update(getattr(record, "fields", {}))
+    return entry
+
+logger = logging.getLogger("llamafs")
+logger.setLevel(logging.DEBUG)
+logger.propagate = False
+
+ring_buffer = RingBufferHandler()
+_listener = None
+_listener_lock = threading.Lock()
+
+def start_logging(log_file=LOG_FILE):
+    """Attach the background file writer. Safe to call more than once."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        records = queue.SimpleQueue()
+        _listener = QueueListener(records, file_handler, respect_handler_level=True)
+        _listener.start()
+        logger.addHandler(ring_buffer)
+        logger.addHandler(_InProcessQueueHandler(records))
+
+def stop_logging():
+    """Flush pending records to disk and stop the writer thread."""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def log(text="", level=logging.INFO, task_id=None, **fields):
+    if _listener is None:
+        start_logging()
+    if task_id is None:
+        task_id = current_task_id.get()
+    if not logger.isEnabledFor(level):
+        return
+    # Build the record directly; Logger.log would walk the stack to find the caller.
+    record = logger.makeRecord(logger.name, level, "", 0, text, None, None, extra={"task_id": task_id, "fields": fields})
+    logger.handle(record)
+
+def get_task_logs(task_id, limit=None):
+    return ring_buffer.get(task_id, limit)
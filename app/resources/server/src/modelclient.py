@@ -1,6 +1,11 @@
 import os
-from groq import AsyncGroq, Groq
+import asyncio
+import time
+from groq import AsyncGroq, Groq, RateLimitError, APIConnectionError, InternalServerError
 import ollama
+from .ratelimit import RetriesExhausted, estimate_tokens, get_rate_limiter
+
+GROQ_MODEL = "llama3-70b-8192"
 
 class ModelClient:
     def __init__(self, model='llama3', async_mode=False, groq_api_key=""):
@@ -8,14 +13,18 @@ class ModelClient:
         self.async_mode = async_mode
         self.groq_api_key = groq_api_key
         self.client = None
+        self.limiter = None
         self.init_client()
 
     def init_client(self):
         if self.model == 'groq':
+            # Retries are handled by the shared limiter, not the SDK. The endpoint can be
+            # pointed at a local stub server through the GROQ_BASE_URL environment variable.
             if self.async_mode:
-                self.client = AsyncGroq(api_key=self.groq_api_key)
+                self.client = AsyncGroq(api_key=self.groq_api_key, max_retries=0)
             else:
-                self.client = Groq(api_key=self.groq_api_key)
+                self.client = Groq(api_key=self.groq_api_key, max_retries=0)
+            self.limiter = get_rate_limiter('groq')
         elif self.model in ['llama3', 'moondream']:
             if self.async_mode:
                 self.client = ollama.AsyncClient()
@@ -24,17 +33,13 @@ class ModelClient:
         else:
             raise ValueError("Unsupported model type. Use 'groq', 'llama3', or 'moondream'.")
 
-    async def query_async(self, messages):
+    async def query_async(self, messages, on_token=None):
+        # When on_token is given, the completion is streamed and each text delta is
+        # awaited through on_token(delta) as it arrives; the full text is still returned.
         if not self.async_mode:
             raise RuntimeError("The client is not set up for asynchronous operation.")
         if self.model == 'groq':
-            response = await self.client.chat.completions.create(
-                messages=messages,
-                model="llama3-70b-8192",
-                response_format={"type": "json_object"},
-                temperature=0
-            )
-            response = response.choices[0].message.content
+            response = await self._query_groq_async(messages, on_token)
         elif self.model in ['llama3', 'moondream']:
             options = {}
             if self.model == 'moondream':
@@ -42,24 +47,28 @@ class ModelClient:
             response = await self.client.chat(
                 messages=messages,
                 model=self.model,
-                options=options
+                options=options,
+                stream=on_token is not None
             )
-            response = response['message']['content']
+            if on_token is not None:
+                content = []
+                async for chunk in response:
+                    delta = chunk['message']['content']
+                    if delta:
+                        content.append(delta)
+                        await on_token(delta)
+                response = "".join(content)
+            else:
+                response = response['message']['content']
         else:
             raise ValueError("Unsupported model type during query.")
         return response
 
-    def query_sync(self, messages):
+    def query_sync(self, messages, on_token=None):
         if self.async_mode:
             raise RuntimeError("The client is not set up for synchronous operation.")
         if self.model == 'groq':
-            response = self.client.chat.completions.create(
-                messages=messages,
-                model="llama3-70b-8192",
-                response_format={"type": "json_object"},
-                temperature=0
-            )
-            response = response.choices[0].message.content
+            response = self._query_groq_sync(messages, on_token)
         elif self.model in ['llama3', 'moondream']:
             options = {}
             if self.model == 'moondream':
@@ -67,9 +76,107 @@ class ModelClient:
             response = self.client.chat(
                 messages=messages,
                 model=self.model,
-                options=options
+                options=options,
+                stream=on_token is not None
             )
-            response = response['message']['content']
+            if on_token is not None:
+                content = []
+                for chunk in response:
+                    delta = chunk['message']['content']
+                    if delta:
+                        content.append(delta)
+                        on_token(delta)
+                response = "".join(content)
+            else:
+                response = response['message']['content']
         else:
             raise ValueError("Unsupported model type during query.")
         return response
+
+    def _groq_request(self, messages, stream=False):
+        request = dict(
+            messages=messages,
+            model=GROQ_MODEL,
+            temperature=0,
+            stream=stream
+        )
+        # JSON mode can't be combined with streaming; the prompts already ask for JSON.
+        if not stream:
+            request["response_format"] = {"type": "json_object"}
+        return request
+
+    def _groq_retry_delay(self, error, attempt):
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+        if isinstance(error, RateLimitError):
+            return self.limiter.on_rate_limited(attempt, headers)
+        return self.limiter.backoff(attempt)
+
+    def _groq_complete(self, raw, estimated_tokens):
+        return self._groq_content(raw, raw.parse(), estimated_tokens)
+
+    async def _groq_complete_async(self, raw, estimated_tokens):
+        # The async SDK's parse() is a coroutine
+        return self._groq_content(raw, await raw.parse(), estimated_tokens)
+
+    def _groq_content(self, raw, completion, estimated_tokens):
+        used_tokens = completion.usage.total_tokens if completion.usage else 0
+        self.limiter.on_success(raw.headers, used_tokens, estimated_tokens)
+        return completion.choices[0].message.content
+
+    def _groq_delta(self, chunk):
+        if not chunk.choices:
+            return None
+        return chunk.choices[0].delta.content
+
+    async def _query_groq_async(self, messages, on_token=None):
+        estimated_tokens = estimate_tokens(messages)
+        stream = on_token is not None
+        for attempt in range(self.limiter.max_retries + 1):
+            content = []
+            await self.limiter.acquire(estimated_tokens)
+            try:
+                raw = await self.client.chat.completions.with_raw_response.create(**self._groq_request(messages, stream))
+                if not stream:
+                    return await self._groq_complete_async(raw, estimated_tokens)
+                async for chunk in await raw.parse():
+                    delta = self._groq_delta(chunk)
+                    if delta:
+                        content.append(delta)
+                        await on_token(delta)
+                self.limiter.on_success(raw.headers)
+                return "".join(content)
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                # Tokens already forwarded can't be taken back, so only retry before the first one.
+                if content:
+                    raise
+                delay = self._groq_retry_delay(e, attempt)
+                if attempt == self.limiter.max_retries:
+                    raise RetriesExhausted(f"Groq request failed after {attempt + 1} attempts: {e}") from e
+            finally:
+                await self.limiter.release()
+            await asyncio.sleep(delay)
+
+    def _query_groq_sync(self, messages, on_token=None):
+        estimated_tokens = estimate_tokens(messages)
+        stream = on_token is not None
+        for attempt in range(self.limiter.max_retries + 1):
+            content = []
+            self.limiter.acquire_sync(estimated_tokens)
+            try:
+                raw = self.client.chat.completions.with_raw_response.create(**self._groq_request(messages, stream))
+                if not stream:
+                    return self._groq_complete(raw, estimated_tokens)
+                for chunk in raw.parse():
+                    delta = self._groq_delta(chunk)
+                    if delta:
+                        content.append(delta)
+                        on_token(delta)
+                self.limiter.on_success(raw.headers)
+                return "".join(content)
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                if content:
+                    raise
+                delay = self._groq_retry_delay(e, attempt)
+                if attempt == self.limiter.max_retries:
+                    raise RetriesExhausted(f"Groq request failed after {attempt + 1} attempts: {e}") from e
+            time.sleep(delay)
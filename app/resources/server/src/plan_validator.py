@@ -0,0 +1,114 @@
+# plan_validator.py
+
+import os
+import posixpath
+import re
+
+INVALID_CHARACTERS = re.compile(r'[<>:"|?*\x00-\x1f]')
+
+def normalize_path(path: str) -> str:
+    """
+    Turn a proposed path into a clean "/"-rooted path inside the base folder.
+
+    Backslashes become slashes, "." and ".." are resolved, segments that would
+    climb out of the base are dropped and characters invalid on common file
+    systems are replaced.
+    """
+    parts = []
+    for part in posixpath.normpath(str(path).replace("\\", "/").strip().lstrip("/") or ".").split("/"):
+        if part in ("", ".", ".."):
+            continue
+        part = INVALID_CHARACTERS.sub("_", part).strip(" .")
+        if part:
+            parts.append(part)
+    return "/" + "/".join(parts)
+
+def clamp_depth(path: str, max_tree_depth: int) -> str:
+    # "/a/b/c/file.txt" has a depth of 3; extra folders beyond the limit are dropped.
+    parts = path.strip("/").split("/")
+    folders, file_name = parts[:-1], parts[-1]
+    return "/" + "/".join(folders[:max(0, max_tree_depth)] + [file_name])
+
+def split_extension(path: str):
+    # Only treat the suffix as an extension if it looks like one, so "v1.2_notes" keeps its dot
+    stem, extension = posixpath.splitext(str(path).replace("\\", "/"))
+    if extension and not re.fullmatch(r"\.[A-Za-z0-9]{1,8}", extension):
+        return path, ""
+    return stem, extension
+
+def restore_extension(path: str, original_path: str) -> str:
+    original_extension = split_extension(original_path)[1]
+    stem, extension = split_extension(path)
+    if extension == original_extension:
+        return path
+    return stem + original_extension
+
+class PlanValidator:
+    """
+    Checks and repairs planned moves one entry at a time, so it can run on a streamed plan.
+
+    Keeps track of every destination handed out so far; a destination that is already
+    taken, or that exists on disk under dest_root, gets a numbered suffix in arrival order.
+    """
+
+    def __init__(self, max_tree_depth, dest_root: str = None, taken=None, placed=None):
+        # taken/placed can be any container with `in` and add(), e.g. a SpillSet for huge batches
+        self.max_tree_depth = int(max_tree_depth)
+        self.dest_root = dest_root
+        self.taken = taken if taken is not None else set()
+        self.placed = placed if placed is not None else set()  # Normalized original paths that already have a destination
+
+    def match_file_path(self, file_info: dict, pending) -> str:
+        """Return which pending file_path an entry refers to, or None if it can't be told."""
+        proposed = str(file_info.get("file_path") or "")
+        if proposed in pending:
+            return proposed
+        normalized = normalize_path(proposed).lower()
+        candidates = [file_path for file_path in pending if normalize_path(file_path).lower() == normalized]
+        if not candidates and proposed:
+            name = posixpath.basename(proposed.replace("\\", "/")).lower()
+            candidates = [file_path for file_path in pending if posixpath.basename(file_path).lower() == name]
+        if not candidates and len(pending) == 1 and normalized not in self.placed:
+            # The model mangled the path, but there is only one file it can mean
+            candidates = list(pending)
+        return candidates[0] if len(candidates) == 1 else None
+
+    def repair(self, file_path: str, new_path: str, enforce_depth: bool = True) -> str:
+        """Return a valid, unique destination for file_path based on the proposed new_path."""
+        path = normalize_path(new_path)
+        if path == "/":
+            path = "/" + posixpath.basename(file_path)
+        if enforce_depth:
+            path = clamp_depth(path, self.max_tree_depth)
+        path = restore_extension(path, file_path)
+        path = self._unique(file_path, path)
+        self.taken.add(path.lower())
+        self.placed.add(normalize_path(file_path).lower())
+        return path
+
+    def _is_taken(self, file_path: str, path: str) -> bool:
+        if path.lower() in self.taken:
+            return True
+        if self.dest_root is None or path == file_path:
+            return False
+        root = self.dest_root.rstrip("/\\")
+        if not os.path.lexists(root + path):
+            return False
+        if path.lower() == file_path.lower():
+            # Only a case change: free if the file system resolves both to the source file itself
+            try:
+                return not os.path.samefile(root + file_path, root + path)
+            except OSError:
+                return True
+        return True
+
+    def _unique(self, file_path: str, path: str) -> str:
+        if not self._is_taken(file_path, path):
+            return path
+        stem, extension = split_extension(path)
+        if extension != split_extension(file_path)[1]:
+            stem, extension = path, ""
+        counter = 2
+        while self._is_taken(file_path, f"{stem}_{counter}{extension}"):
+            counter += 1
+        return f"{stem}_{counter}{extension}"
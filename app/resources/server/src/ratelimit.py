@@ -0,0 +1,222 @@
+# ratelimit.py
+
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+WINDOW_SECONDS = 60.0
+
+class RetriesExhausted(RuntimeError):
+    """Raised when a request still fails (rate limit, connection or server error) after the retry budget is spent."""
+
+def estimate_tokens(messages) -> int:
+    # Rough estimate (~4 characters per token), good enough for budgeting.
+    chars = 0
+    for message in messages:
+        content = message.get("content") or ""
+        chars += len(content) if isinstance(content, str) else len(str(content))
+    return max(1, chars // 4)
+
+def parse_duration(value) -> float:
+    # Accepts plain seconds ("12", "0.5") and Groq style durations ("2m59.56s", "120ms").
+    if value is None:
+        return 0.0
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value):
+        matched = True
+        amount = float(amount)
+        if unit == "ms":
+            total += amount / 1000
+        elif unit == "s":
+            total += amount
+        elif unit == "m":
+            total += amount * 60
+        elif unit == "h":
+            total += amount * 3600
+    return total if matched else 0.0
+
+def _header(headers, name):
+    if not headers:
+        return None
+    try:
+        return headers.get(name)
+    except AttributeError:
+        return None
+
+def parse_retry_after(headers) -> float:
+    # Prefer the explicit hint, then fall back on whichever quota resets last.
+    retry_after = parse_duration(_header(headers, "retry-after"))
+    if retry_after:
+        return retry_after
+    return max(
+        parse_duration(_header(headers, "x-ratelimit-reset-requests")),
+        parse_duration(_header(headers, "x-ratelimit-reset-tokens")),
+    )
+
+class RateLimiter:
+    """
+    Client-side limiter for one model backend.
+
+    Keeps sliding one-minute windows of request and token usage, holds every
+    caller back while the backend has asked us to wait (retry-after), and
+    adjusts the number of concurrent requests with AIMD: +1 slot per window of
+    successes, halved on every 429.
+    """
+
+    def __init__(self, requests_per_minute=30, tokens_per_minute=6000, max_concurrency=8,
+                 max_retries=6, base_delay=1.0, max_delay=60.0):
+        # The configured budget; observed rate limit headers move the effective one up or down from here.
+        self.configured_requests_per_minute = requests_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.concurrency = 1.0
+        self.in_flight = 0
+        self.blocked_until = 0.0
+
+        self._requests = deque()  # request timestamps
+        self._tokens = deque()  # (timestamp, tokens)
+        self._token_total = 0
+        self._lock = threading.Lock()
+        self._condition = None
+
+    def _prune(self, now):
+        while self._requests and now - self._requests[0] >= WINDOW_SECONDS:
+            self._requests.popleft()
+        while self._tokens and now - self._tokens[0][0] >= WINDOW_SECONDS:
+            self._token_total -= self._tokens.popleft()[1]
+
+    def _reserve(self, tokens) -> float:
+        """Record the request if the windows allow it and return 0, otherwise return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self._prune(now)
+
+            wait = 0.0
+            if len(self._requests) >= self.requests_per_minute:
+                wait = max(wait, self._requests[0] + WINDOW_SECONDS - now)
+            # A single request larger than the whole budget can only wait for an empty window.
+            tokens = min(tokens, self.tokens_per_minute)
+            if self._tokens and self._token_total + tokens > self.tokens_per_minute:
+                freed = 0
+                for timestamp, count in self._tokens:
+                    freed += count
+                    if self._token_total - freed + tokens <= self.tokens_per_minute:
+                        wait = max(wait, timestamp + WINDOW_SECONDS - now)
+                        break
+            if wait > 0:
+                return wait
+
+            self._requests.append(now)
+            self._tokens.append((now, tokens))
+            self._token_total += tokens
+            return 0.0
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, tokens: int):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < max(1, int(self.concurrency)))
+            self.in_flight += 1
+        try:
+            while (wait := self._reserve(tokens)) > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            await self.release()
+            raise
+
+    async def release(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def acquire_sync(self, tokens: int):
+        # Synchronous callers are serial per thread, so only the windows apply.
+        while (wait := self._reserve(tokens)) > 0:
+            time.sleep(wait)
+
+    def backoff(self, attempt: int, retry_after: float = 0.0) -> float:
+        # Full jitter exponential backoff, never shorter than the server's hint.
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        return min(self.max_delay, max(delay, retry_after))
+
+    def _update_limits(self, headers):
+        limit_requests = _header(headers, "x-ratelimit-limit-requests")
+        limit_tokens = _header(headers, "x-ratelimit-limit-tokens")
+        try:
+            if limit_requests:
+                # Groq reports requests per day, which says nothing about the per-minute rate, so the
+                # configured budget applies, recomputed each time so a higher daily limit lifts it again.
+                self.requests_per_minute = max(1, min(self.configured_requests_per_minute, int(limit_requests)))
+            if limit_tokens:
+                # Tokens are reported per minute and replace the budget in either direction.
+                self.tokens_per_minute = max(1, int(limit_tokens))
+        except ValueError:
+            pass
+
+    def on_success(self, headers=None, used_tokens: int = 0, estimated_tokens: int = 0):
+        with self._lock:
+            self._update_limits(headers)
+            # Replace the estimate with real usage so the token window tracks what was billed.
+            if used_tokens and self._tokens:
+                delta = used_tokens - estimated_tokens
+                timestamp, count = self._tokens[-1]
+                self._tokens[-1] = (timestamp, max(0, count + delta))
+                self._token_total = max(0, self._token_total + delta)
+            remaining = _header(headers, "x-ratelimit-remaining-tokens")
+            if remaining is not None and str(remaining).strip() == "0":
+                reset = parse_duration(_header(headers, "x-ratelimit-reset-tokens"))
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+
+    def on_rate_limited(self, attempt: int, headers=None) -> float:
+        """Shrink concurrency, pause all callers for the retry-after hint and return the delay for this caller."""
+        retry_after = parse_retry_after(headers)
+        delay = self.backoff(attempt, retry_after)
+        with self._lock:
+            self._update_limits(headers)
+            self.concurrency = max(1.0, self.concurrency / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        return delay
+
+_limiters = {}
+
+def _env_limit(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ[name]))
+    except (KeyError, ValueError):
+        return default
+
+def get_rate_limiter(backend: str) -> RateLimiter:
+    # One limiter per backend, shared by every ModelClient in the process. The defaults match
+    # Groq's free tier; accounts with higher limits set e.g. GROQ_REQUESTS_PER_MINUTE and
+    # GROQ_TOKENS_PER_MINUTE.
+    if backend not in _limiters:
+        prefix = backend.upper()
+        _limiters[backend] = RateLimiter(
+            requests_per_minute=_env_limit(f"{prefix}_REQUESTS_PER_MINUTE", 30),
+            tokens_per_minute=_env_limit(f"{prefix}_TOKENS_PER_MINUTE", 6000),
+        )
+    return _limiters[backend]
@@ -0,0 +1,181 @@
+# renamer.py
+
+import fnmatch
+import os
+import re
+from datetime import datetime
+
+try:
+    from PIL import Image
+except ImportError:  # EXIF tokens fall back to file metadata without Pillow
+    Image = None
+
+TOKEN_PATTERN = re.compile(r"\{([A-Z_]+)\}")
+SEPARATORS = r"[_\-. ]+"
+
+# What each token renders to, for recognizing names rendered by an earlier run
+TOKEN_VALUE_PATTERNS = {
+    "YEAR": r"\d{4}",
+    "MONTH": r"\d{2}",
+    "DAY": r"\d{2}",
+    "HOUR": r"\d{2}",
+    "MINUTE": r"\d{2}",
+    "SIZE": r"\d+(?:\.\d+)?[KMGT]?B",
+    "CAMERA": r"[a-z0-9_]*?",
+    "WIDTH": r"\d*",
+    "HEIGHT": r"\d*",
+    "EXTENSION": r"[A-Za-z0-9]*",
+}
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".heic", ".webp"}
+
+# EXIF tag ids
+EXIF_IFD = 0x8769
+EXIF_DATETIME = 306
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_MAKE = 271
+EXIF_MODEL = 272
+
+def format_compact_size(size: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}".replace(".0", "")
+        size /= 1024
+    return f"{size:.1f}TB".replace(".0", "")
+
+def slugify(text: str, max_length: int = 48) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", str(text).lower()).strip("_")
+    return slug[:max_length].rstrip("_")
+
+def read_exif(file_path: str) -> dict:
+    if Image is None or os.path.splitext(file_path)[1].lower() not in IMAGE_EXTENSIONS:
+        return {}
+    try:
+        with Image.open(file_path) as image:
+            exif = image.getexif()
+            details = dict(exif)
+            details.update(exif.get_ifd(EXIF_IFD))
+            details["width"], details["height"] = image.size
+            return details
+    except Exception:
+        return {}
+
+def file_metadata(file_path: str) -> dict:
+    """Collect the values available to file_format tokens for one file."""
+    stem, extension = os.path.splitext(os.path.basename(file_path))
+    stat = os.stat(file_path)
+    exif = read_exif(file_path)
+
+    date = datetime.fromtimestamp(stat.st_mtime)
+    exif_date = exif.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    if exif_date:
+        try:
+            date = datetime.strptime(str(exif_date).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+        except ValueError:
+            pass
+
+    camera = " ".join(str(exif[tag]).strip("\x00 ") for tag in (EXIF_MAKE, EXIF_MODEL) if exif.get(tag))
+
+    return {
+        "YEAR": f"{date.year:04d}",
+        "MONTH": f"{date.month:02d}",
+        "DAY": f"{date.day:02d}",
+        "HOUR": f"{date.hour:02d}",
+        "MINUTE": f"{date.minute:02d}",
+        "NAME": stem,
+        "EXTENSION": extension[1:],
+        "SIZE": format_compact_size(stat.st_size),
+        "CAMERA": slugify(camera),
+        "WIDTH": str(exif.get("width", "")),
+        "HEIGHT": str(exif.get("height", "")),
+    }
+
+def name_template(file_format: str) -> str:
+    # The original extension is always kept, whether or not the format spells it out.
+    return file_format[:-len(".{EXTENSION}")] if file_format.endswith(".{EXTENSION}") else file_format
+
+def strip_rendered_name(name: str, file_format: str, metadata: dict = None) -> str:
+    """
+    Return the {CONTENT} part of a file name stem that was already rendered from file_format,
+    or the name unchanged, so organizing a folder again doesn't stack prefixes.
+
+    Tokens match the file's own metadata values first (moves keep mtime and EXIF), then any
+    value the token could have rendered to.
+    """
+    metadata = metadata or {}
+    regex = ""
+    has_content = False
+    for piece in re.split(r"(\{[A-Z_]+\}|[_\-. ]+)", name_template(file_format)):
+        if not piece:
+            continue
+        token = TOKEN_PATTERN.fullmatch(piece)
+        if token is None:
+            # Empty tokens collapse their separators when rendering, so separators are optional
+            regex += r"[_\-. ]*" if re.fullmatch(SEPARATORS, piece) else re.escape(piece)
+        elif token.group(1) == "CONTENT" and not has_content:
+            regex += "(?P<content>.+?)"
+            has_content = True
+        else:
+            generic = TOKEN_VALUE_PATTERNS.get(token.group(1), ".*?")
+            value = metadata.get(token.group(1))
+            regex += f"(?:{re.escape(value)}|{generic})" if value else f"(?:{generic})"
+    if not has_content:
+        return name
+    match = re.fullmatch(regex, name, re.IGNORECASE)
+    return match.group("content") if match else name
+
+def render_file_name(file_format: str, metadata: dict, content: str) -> str:
+    """
+    Fill file_format (e.g. "{MONTH}_{DAY}_{YEAR}_{CONTENT}.{EXTENSION}") from metadata.
+
+    Unknown or empty tokens are dropped along with the separators they leave behind.
+    """
+    values = dict(metadata, CONTENT=slugify(content) or slugify(metadata.get("NAME", "")) or "file")
+    template = name_template(file_format)
+    stem = TOKEN_PATTERN.sub(lambda match: values.get(match.group(1), ""), template)
+    stem = re.sub(r"([_\-. ])[_\-. ]+", r"\1", stem).strip("_-. ") or values["CONTENT"]
+    if not metadata.get("EXTENSION"):
+        return stem
+    return f"{stem}.{metadata['EXTENSION']}"
+
+def join_new_path(folder: str, file_name: str) -> str:
+    folder = "/".join(part for part in str(folder).replace("\\", "/").split("/") if part)
+    return f"/{folder}/{file_name}" if folder else f"/{file_name}"
+
+def match_rule(rules, file_path: str):
+    """
+    Return the first rule matching file_path (relative to the organized folder), or None.
+
+    A rule is a dict with "pattern" and "folder", plus an optional "file_format".
+    Patterns starting with "." are extensions; anything else is a glob matched
+    against both the relative path and the file name.
+    """
+    if not rules:
+        return None
+    relative_path = file_path.replace("\\", "/").lstrip("/")
+    file_name = os.path.basename(relative_path)
+    for rule in rules:
+        pattern = rule["pattern"].strip()
+        if pattern.startswith(".") and not any(char in pattern for char in "*?[/"):
+            if file_name.lower().endswith(pattern.lower()):
+                return rule
+        elif fnmatch.fnmatch(relative_path.lower(), pattern.lower()) or fnmatch.fnmatch(file_name.lower(), pattern.lower()):
+            return rule
+    return None
+
+def rule_new_path(rule: dict, metadata: dict, file_format: str) -> str:
+    # Rule placements have no summary, so the original name stands in for {CONTENT}.
+    file_format = rule.get("file_format") or file_format
+    file_name = render_file_name(file_format, metadata, strip_rendered_name(metadata["NAME"], file_format, metadata))
+    return join_new_path(rule["folder"], file_name)
+
+def llm_new_path(file_info: dict, metadata: dict, file_format: str) -> str:
+    """Build new_path from the model's folder/content answer, or from a legacy new_path answer."""
+    if "folder" in file_info or "content" in file_info:
+        folder = file_info.get("folder") or ""
+        content = file_info.get("content") or strip_rendered_name(metadata["NAME"], file_format, metadata)
+    else:
+        new_path = str(file_info["new_path"]).replace("\\", "/")
+        folder = os.path.dirname(new_path)
+        content = os.path.splitext(os.path.basename(new_path))[0]
+    return join_new_path(folder, render_file_name(file_format, metadata, content))
@@ -0,0 +1,110 @@
+# staging.py
+
+import os
+import sqlite3
+import tempfile
+from typing import NamedTuple
+
+class FileSummary(NamedTuple):
+    """Compact per-file record passed between the batch stages."""
+    file_path: str
+    summary: str
+
+class StagingStore:
+    """
+    Temporary SQLite file holding the intermediate results of one batch, so the
+    stages only keep the file they are working on in memory.
+
+    The data is throwaway, so durability is switched off; close() deletes the file.
+    """
+
+    FETCH_SIZE = 256
+
+    def __init__(self):
+        handle, self.db_path = tempfile.mkstemp(prefix="llamafs_", suffix=".db")
+        os.close(handle)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("CREATE TABLE chunk_summaries (id INTEGER PRIMARY KEY, file_path TEXT NOT NULL, summary TEXT NOT NULL)")
+        self.connection.execute("CREATE INDEX chunk_summaries_path ON chunk_summaries (file_path, id)")
+        self.connection.execute("CREATE TABLE file_summaries (id INTEGER PRIMARY KEY, file_path TEXT NOT NULL, original_path TEXT NOT NULL, summary TEXT NOT NULL, stratum TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE sets (name TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (name, value)) WITHOUT ROWID")
+
+    def add_summary(self, file_path: str, summary: str):
+        self.connection.execute("INSERT INTO chunk_summaries (file_path, summary) VALUES (?, ?)", (file_path, summary or ""))
+
+    def file_count(self) -> int:
+        return self.connection.execute("SELECT count(DISTINCT file_path) FROM chunk_summaries").fetchone()[0]
+
+    def iter_file_summaries(self):
+        """Yield (file_path, [chunk summaries]) per file, reading the table in small pages."""
+        cursor = self.connection.execute("SELECT file_path, summary FROM chunk_summaries ORDER BY file_path, id")
+        current_path, chunks = None, []
+        while rows := cursor.fetchmany(self.FETCH_SIZE):
+            for file_path, summary in rows:
+                if file_path != current_path and current_path is not None:
+                    yield current_path, chunks
+                    chunks = []
+                current_path = file_path
+                chunks.append(summary)
+        if current_path is not None:
+            yield current_path, chunks
+
+    def add_file_summary(self, summary: FileSummary, original_path: str, stratum: str):
+        self.connection.execute(
+            "INSERT INTO file_summaries (file_path, original_path, summary, stratum) VALUES (?, ?, ?, ?)",
+            (summary.file_path, original_path, summary.summary or "", stratum)
+        )
+
+    def file_summary_count(self) -> int:
+        return self.connection.execute("SELECT count(*) FROM file_summaries").fetchone()[0]
+
+    def sample_file_summaries(self, limit: int) -> list:
+        """
+        Return up to limit (FileSummary, original_path) pairs spread evenly over the strata:
+        the first file of every stratum, then the second of every stratum, and so on.
+        """
+        rows = self.connection.execute(
+            """
+            SELECT file_path, original_path, summary FROM (
+                SELECT file_path, original_path, summary, stratum,
+                       row_number() OVER (PARTITION BY stratum ORDER BY file_path) AS position
+                FROM file_summaries
+            )
+            ORDER BY position, stratum
+            LIMIT ?
+            """,
+            (limit,)
+        ).fetchall()
+        return [(FileSummary(file_path, summary), original_path) for file_path, original_path, summary in rows]
+
+    def iter_file_summaries_for_planning(self):
+        """Yield (FileSummary, original_path) for every stored file, reading the table in small pages."""
+        cursor = self.connection.execute("SELECT file_path, original_path, summary FROM file_summaries ORDER BY id")
+        while rows := cursor.fetchmany(self.FETCH_SIZE):
+            for file_path, original_path, summary in rows:
+                yield FileSummary(file_path, summary), original_path
+
+    def spill_set(self, name: str):
+        return SpillSet(self.connection, name)
+
+    def close(self):
+        self.connection.close()
+        try:
+            os.remove(self.db_path)
+        except OSError:
+            pass
+
+class SpillSet:
+    """Set of strings kept in the staging database instead of in memory."""
+
+    def __init__(self, connection, name: str):
+        self.connection = connection
+        self.name = name
+
+    def __contains__(self, value) -> bool:
+        return self.connection.execute("SELECT 1 FROM sets WHERE name = ? AND value = ?", (self.name, value)).fetchone() is not None
+
+    def add(self, value):
+        self.connection.execute("INSERT OR IGNORE INTO sets (name, value) VALUES (?, ?)", (self.name, value))
@@ -1,152 +1,356 @@
 # tree_generator.py
 
+import asyncio
 import json
 import os
+from collections import deque
 from .modelclient import ModelClient
-import time
-
-# Logging function
-def log(text="", console_only=True):
-    if not console_only:
-        # Write to the latest.log file
-        with open('./latest.log', 'a') as log_file:
-            timestamp = time.strftime("[%Y-%m-%d %H:%M:%S]")
-            log_file.write(f"{timestamp} {text}\n")
-    return
-
-def get_deepest_paths(directories):
-    # Helper function to get the deepest unique paths
-    deepest_paths = set()
-    for directory in directories:
-        parts = directory.strip('/').split('/')
-        for i in range(1, len(parts) + 1):
-            deepest_paths.add('/' + '/'.join(parts[:i]))
-    return deepest_paths
-
-async def create_file_tree(path: str, summaries: list, model: str, instruction: str, max_tree_depth: str, file_format: str, groq_api_key: str, notify_clients, task_id: str):
-    BATCH_SIZE = 1  # Process 10 summaries at a time
-
-    FILE_PROMPT_TEMPLATE = """
-    You just received a list of source files and a summary of their contents. For each file, propose a new path and filename, using a directory structure that optimally organizes the files using known conventions and best practices.
-    Follow good naming conventions. Here are a few guidelines:
-    - Think about your files: What related files are you working with?
-    - Identify metadata (for example, date, sample, experiment): What information is needed to easily locate a specific file?
-    - Abbreviate or encode metadata
-    - Use versioning: Are you maintaining different versions of the same file?
-    - Think about how you will search for your files: What comes first?
-    - Deliberately separate metadata elements: Avoid spaces or special characters in your file names
-    If the file is already named well or matches a known convention, set the destination path to the same as the source path.
-
-    You must keep the new_path at or below a max depth of {max_tree_depth} folders from the base.
-    If the new_path is "/organized_file.png", this is a depth of 0. A new_path of "/one/two/three/organized_file.png" is a depth of 3.
-    Remember, keep new_path outputs in your response to a max depth of {max_tree_depth} or less. You must not exceed {max_tree_depth} directories deep.
-    The number of directories deep any file exists must be no more than {max_tree_depth}, ideally less. Most files should be within 2 or 3 directory levels.
-
-    Here is the list of the deepest paths created so far:
-    {deepest_paths}
-
-    Do not use too generic names like "organized" or "organized_files" or similar names in directories or files. Be descriptive with your names, 
-    using things such as relevant dates or similar concepts from the summaries for each file.
-
-    Additionally in terms of organizing conventions for each file, use the following as a final guidance for how to name the directories and subdirectires along new_path as you relate the summary to a potential new_path: {instruction}
-
-    Do not include ANYTHING ELSE in your response output except this JSON object as plain text. No prepending or appended introduction or explanation of your work, only the following JSON.
-    Your response must be a JSON object with the following schema:
-    {{
-        "files": [
-            {{
-                "file_path": "original file_path with original extension you must replicate",
-                "new_path": "new file path under proposed directory structure with proposed file name and identical file extension. Keep the file extension and do not modify it."
-            }}
-        ]
-    }}
-
-    Limit your response to this JSON content, where there is an entry in "files" for every individual summary.
-    Carefully refer to the original file path for each summary, and create an appropriate dst_path.
-    Do not include ANYTHING ELSE in your response except this JSON object as plain text. No prepending or appended introduction or explanation of your work, only the JSON.
-    The "files" list must be the same length as the original summaries, and for each file_path from the summaries, should exist in the new JSON as file_path with a corresponding new_path.
-    Do not make up file_path entries, re-use them from the incoming summaries JSON list.
-    """.strip()
-
-    # TO ADD:
-    #    
-    #You must keep the new_path at or below a max depth of {max_tree_depth} folders from the base.
-    #If the new_path is "/organized_file.png", this is a depth of 0. A new_path of "/one/two/three/organized_file.png" is a depth of 3.
-    #Remember, keep new_path outputs in your response to a max depth of {max_tree_depth} or less. You must not exceed {max_tree_depth} directories deep.
-    #The number of directories deep any file exists must be no more than {max_tree_depth}, ideally less. Most files should be within 2 or 3 directory levels.
-    
-    client = ModelClient(model=model, groq_api_key=groq_api_key)
-    final_files = []  # List to accumulate results from all batches
-    all_new_paths = set()  # Set to track all new paths
+from .jsonstream import JsonArrayStreamParser
+from .ratelimit import RetriesExhausted
+from .renamer import file_metadata, llm_new_path, match_rule, rule_new_path
+from .plan_validator import PlanValidator, normalize_path
+from .logger import log
+from .staging import FileSummary, StagingStore
+
+# Planning runs in two phases: a taxonomy is derived from a stratified sample of the
+# summaries, then every file is assigned to that fixed taxonomy in parallel batches.
+# The cost of the first phase depends on TAXONOMY_SAMPLE_SIZE, not on the number of files.
+TAXONOMY_SAMPLE_SIZE = 60  # Files shown to the model when deriving the taxonomy
+TAXONOMY_CHUNK_SIZE = 30  # Sample files per taxonomy call; later calls refine the taxonomy
+CLASSIFY_BATCH_SIZE = 20  # Files per classification call
+PARALLEL_BATCHES = 4  # Classification calls in flight at once
+MAX_ATTEMPTS = 3  # Give up on a file after this many bad responses
+SUMMARY_PREVIEW_LENGTH = 500  # Characters of each summary sent to the model
+
+TAXONOMY_PROMPT_TEMPLATE = """
+You will receive a representative sample of the files in a folder that is about to be organized, with the file path and a summary of each file's contents.
+Design the folder structure (the "taxonomy") that ALL files of the folder will be sorted into, not only the files in this sample, using known conventions and best practices.
+Follow good naming conventions. Here are a few guidelines:
+- Think about your files: What related files are you working with?
+- Think about how you will search for your files: What comes first?
+- Deliberately separate metadata elements: Avoid spaces or special characters in folder names
+- Prefer a small number of meaningful folders over one folder per file
+
+You must keep every folder at or below a max depth of {max_tree_depth} folders from the base.
+A folder of "/one/two/three" is a depth of 3. Most folders should be within 2 or 3 directory levels.
+
+Do not use too generic names like "organized" or "organized_files" or similar names in directories. Be descriptive with your names,
+using things such as relevant concepts from the summaries.
+
+Additionally in terms of organizing conventions, use the following as a final guidance for how to name the directories and subdirectories: {instruction}
+
+{existing_taxonomy}
+
+Do not include ANYTHING ELSE in your response output except this JSON object as plain text. No prepending or appended introduction or explanation of your work, only the following JSON.
+Your response must be a JSON object with the following schema:
+{{
+    "folders": [
+        {{
+            "path": "folder path, e.g. /finance/invoices",
+            "description": "one sentence describing which files belong in this folder"
+        }}
+    ]
+}}
+""".strip()
+
+CLASSIFY_PROMPT_TEMPLATE = """
+You just received a list of source files and a summary of their contents. For each file, choose the folder it belongs in and a short content slug describing the file.
+{taxonomy_instruction}
+The final file name is built automatically from the slug using the format {file_format}, so dates, sizes and the file extension are filled in for you.
+- Keep the content slug to a few lowercase words separated by underscores, e.g. "quarterly_sales_report"
+- Do not put dates or the file extension in the content slug
+- Do not use too generic slugs like "file" or "document"; be specific to each file's summary
+
+Additionally in terms of organizing conventions for each file, use the following as a final guidance: {instruction}
+
+Do not include ANYTHING ELSE in your response output except this JSON object as plain text. No prepending or appended introduction or explanation of your work, only the following JSON.
+Your response must be a JSON object with the following schema:
+{{
+    "files": [
+        {{
+            "file_path": "original file_path with original extension you must replicate",
+            "folder": "the chosen folder",
+            "content": "short content slug for the file name"
+        }}
+    ]
+}}
+
+Limit your response to this JSON content, where there is an entry in "files" for every individual summary.
+The "files" list must be the same length as the original summaries, and for each file_path from the summaries, should exist in the new JSON as file_path with a corresponding folder and content.
+Do not make up file_path entries, re-use them from the incoming summaries JSON list.
+""".strip()
+
+def get_stratum(file_path: str, original_path: str) -> str:
+    # Files are stratified by extension, order of magnitude of their size and top-level folder
+    extension = os.path.splitext(file_path)[1].lower()
+    try:
+        size_class = len(str(os.path.getsize(original_path)))
+    except OSError:
+        size_class = 0
+    parts = file_path.strip("/").split("/")
+    top_folder = parts[0] if len(parts) > 1 else ""
+    return f"{extension}|{size_class}|{top_folder}"
+
+def preview(summary: FileSummary) -> dict:
+    return {"file_path": summary.file_path, "summary": (summary.summary or "")[:SUMMARY_PREVIEW_LENGTH]}
+
+def normalize_folder(folder: str, max_tree_depth: int) -> str:
+    parts = normalize_path(folder).strip("/").split("/")
+    return "/" + "/".join(part for part in parts[:max(0, max_tree_depth)] if part)
+
+def snap_to_taxonomy(folder: str, taxonomy: dict, max_tree_depth: int):
+    """Return the taxonomy folder a proposed folder refers to, or None if it is not part of it."""
+    if not taxonomy:
+        return folder
+    folder = normalize_folder(folder, max_tree_depth)
+    if folder.lower() in taxonomy:
+        return taxonomy[folder.lower()]
+    # A subfolder of a taxonomy folder is snapped to the deepest taxonomy folder containing it
+    for candidate in sorted(taxonomy, key=len, reverse=True):
+        if folder.lower().startswith(candidate.rstrip("/") + "/"):
+            return taxonomy[candidate]
+    return None
+
+async def derive_taxonomy(client, sample: list, instruction: str, max_tree_depth: int) -> list:
+    """Ask the model for a taxonomy covering the sample, a chunk of the sample per call."""
+    folders = []
+    for start in range(0, len(sample), TAXONOMY_CHUNK_SIZE):
+        chunk = [preview(summary) for summary, _ in sample[start:start + TAXONOMY_CHUNK_SIZE]]
+        existing_taxonomy = ""
+        if folders:
+            existing_taxonomy = (
+                "Here is the taxonomy designed from earlier files. Return it in full, keeping its folders "
+                "and adding or adjusting folders only where these files don't fit:\n"
+                + json.dumps(folders, indent=2)
+            )
+        prompt = TAXONOMY_PROMPT_TEMPLATE.format(
+            instruction=instruction,
+            max_tree_depth=max_tree_depth,
+            existing_taxonomy=existing_taxonomy
+        )
+
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                response = await client.query_async([
+                    {"role": "user", "content": json.dumps(chunk)},
+                    {"role": "user", "content": prompt},
+                ])
+                log(f"taxonomy response: {response}")
+                proposed = json.loads(response[response.index("{"):response.rindex("}") + 1])["folders"]
+                break
+            except RetriesExhausted as e:
+                log(f"Keeping the taxonomy derived so far: {e}")
+                return folders
+            except Exception as e:
+                log(f"Taxonomy attempt {attempt + 1}/{MAX_ATTEMPTS} failed: {e}")
+        else:
+            continue
+
+        revised = {}
+        for folder in proposed:
+            if not isinstance(folder, dict) or not folder.get("path"):
+                continue
+            folder_path = normalize_folder(folder["path"], max_tree_depth)
+            if folder_path != "/" and folder_path.lower() not in revised:
+                revised[folder_path.lower()] = {"path": folder_path, "description": str(folder.get("description", ""))}
+        if revised:
+            folders = list(revised.values())
+
+    return folders
+
+async def create_file_tree(path: str, summaries, model: str, instruction: str, max_tree_depth: str, file_format: str, groq_api_key: str, notify_clients, task_id: str, on_file=None, rules=None, dest_root=None, total_files=None, staging=None):
+    client = ModelClient(model=model, async_mode=True, groq_api_key=groq_api_key)
+    final_files = []  # Planned entries, only collected when there is no on_file consumer
+    max_depth = int(max_tree_depth)
+    planned = 0
+
+    # Summaries are kept in the staging database between the two phases
+    own_staging = staging is None
+    if own_staging:
+        staging = StagingStore()
+    validator = PlanValidator(max_tree_depth, dest_root, staging.spill_set("taken"), staging.spill_set("placed"))
+    in_flight = deque()  # (classification task, queue of its accepted entries), oldest first
 
     log(f"path: {path}")
 
-    # Adjust file paths in summaries
-    for summary in summaries:
-        original_file_path = summary["file_path"]
-        log(f"file_path before: {original_file_path}")
-        
-        # Replace the `path` variable with `/` and then replace backslashes
-        temp_path = original_file_path.replace(path, "/")
-        summary["file_path"] = temp_path.replace("\\", "/").replace("//", "/")
-        
-        after_file_path = summary["file_path"]
-        log(f"file_path after: {after_file_path}")
-
-    # Process each batch
-    for i in range(0, len(summaries), BATCH_SIZE):
-        done = False
-
-        while not done:
+    async def add_file(file_info, enforce_depth=True):
+        nonlocal planned
+        # Repair the destination locally instead of asking the model again
+        file_info["new_path"] = validator.repair(file_info["file_path"], file_info["new_path"], enforce_depth)
+        log(f"file_info: {file_info}")
+
+        await notify_clients(task_id, {"event": "planned", "file_path": file_info["file_path"], "new_path": file_info["new_path"]})
+        if on_file is not None:
+            await on_file(file_info)
+        else:
+            final_files.append(file_info)
+
+        planned += 1
+        await notify_clients(task_id, {"event": "progress", "type": 2, "progress": f"{planned}/{total_files or planned}"})
+
+    try:
+        # Collect the summaries; files matched by a user rule are placed locally without asking the model
+        async for summary in iterate_summaries(summaries):
+            original_file_path = summary.file_path
+            log(f"file_path before: {original_file_path}")
+
+            # Make the path relative to `path`, rooted at `/` and with forward slashes
+            temp_path = "/" + os.path.relpath(original_file_path, path)
+            summary = summary._replace(file_path=temp_path.replace("\\", "/").replace("//", "/"))
+
+            log(f"file_path after: {summary.file_path}")
+
+            rule = match_rule(rules, summary.file_path)
+            if rule is not None:
+                try:
+                    metadata = file_metadata(original_file_path)
+                except OSError as e:
+                    log(f"Leaving {summary.file_path} in place: {e}")
+                    continue
+                await add_file({
+                    "file_path": summary.file_path,
+                    "new_path": rule_new_path(rule, metadata, file_format)
+                }, enforce_depth=False)
+            else:
+                staging.add_file_summary(summary, original_file_path, get_stratum(summary.file_path, original_file_path))
+
+        if staging.file_summary_count() == 0:
+            return final_files
+
+        # Phase 1: derive the taxonomy from a stratified sample
+        sample = staging.sample_file_summaries(TAXONOMY_SAMPLE_SIZE)
+        folders = await derive_taxonomy(client, sample, instruction, max_depth)
+        taxonomy = {folder["path"].lower(): folder["path"] for folder in folders}
+        log(f"taxonomy: {folders}")
+        await notify_clients(task_id, {"event": "taxonomy", "folders": folders})
+
+        if folders:
+            taxonomy_instruction = (
+                "You must put every file in exactly one of the following folders, using the folder path exactly as written. "
+                "Do not invent new folders.\n" + json.dumps(folders, indent=2)
+            )
+        else:
+            taxonomy_instruction = f"Choose a descriptive folder at or below a max depth of {max_depth} folders from the base."
+
+        prompt = CLASSIFY_PROMPT_TEMPLATE.format(
+            taxonomy_instruction=taxonomy_instruction,
+            file_format=file_format,
+            instruction=instruction
+        )
+
+        async def classify_batch(batch_number, batch, accepted):
+            """Put each accepted entry of one batch on the accepted queue as it streams in, then None."""
             try:
-                batch_summaries = summaries[i:i + BATCH_SIZE]  # Get current batch
+                await classify_entries(batch_number, batch, accepted)
+            finally:
+                accepted.put_nowait(None)
 
-                # Update the deepest paths for the current FILE_PROMPT
-                deepest_paths = "\n".join(sorted(get_deepest_paths(all_new_paths)))
+        async def classify_entries(batch_number, batch, accepted):
+            pending = {summary.file_path: summary for summary, _ in batch}
+            original_paths = {summary.file_path: original_path for summary, original_path in batch}
 
-                FILE_PROMPT = FILE_PROMPT_TEMPLATE.format(
-                    instruction=instruction,
-                    deepest_paths=deepest_paths,
-                    max_tree_depth=max_tree_depth
-                )
+            def accept(file_info):
+                if not isinstance(file_info, dict) or file_info.get("folder") is None:
+                    log(f"Ignoring malformed entry: {file_info}")
+                    return
+                # LLM sometimes messes up original filepath, so match it back to the batch.
+                file_path = validator.match_file_path(file_info, pending)
+                if file_path is None:
+                    log(f"Could not match entry to a file in the batch: {file_info}")
+                    return
+                folder = snap_to_taxonomy(str(file_info["folder"]), taxonomy, max_depth)
+                if folder is None:
+                    log(f"Folder outside the taxonomy for {file_path}: {file_info['folder']}")
+                    return
+                del pending[file_path]
 
-                response = client.query_sync([
-                    {"role": "user", "content": json.dumps(batch_summaries)},
-                    {"role": "user", "content": FILE_PROMPT},
-                ])
+                # The model only picks the folder and {CONTENT}; the name itself comes from file_format.
+                try:
+                    metadata = file_metadata(original_paths[file_path])
+                except OSError as e:
+                    # The file disappeared (or became unreadable) after the scan
+                    log(f"Leaving {file_path} in place: {e}")
+                    return
+                accepted.put_nowait({
+                    "file_path": file_path,
+                    "new_path": llm_new_path({"folder": folder, "content": file_info.get("content")}, metadata, file_format)
+                })
 
-                # Log the raw response for debugging
-                #log(f"batch_summaries: {batch_summaries}")
-                #log(f"deepest_paths: {deepest_paths}")
-                log(f"response: {response}")
+            for attempt in range(MAX_ATTEMPTS):
+                # Only files without a usable entry are sent again
+                batch_summaries = [preview(summary) for summary in pending.values()]
+                parser = JsonArrayStreamParser("files")
 
-                # Ensure the response is a valid JSON string
-                if not response:
-                    raise ValueError("Received empty response from ModelClient")
+                async def on_token(delta, parser=parser):
+                    for file_info in parser.feed(delta):
+                        accept(file_info)
 
                 try:
-                    batch_files = json.loads(response)["files"]
-                    # NOTE: This will not work if batch size is moved off of 1.
-                    # LLM sometimes messes up original filepath, which is why we are doing htis.
-                    batch_files[0]["file_path"] = batch_summaries[0]["file_path"]
-                    log(f"batch_files: {batch_files}")
-                except json.JSONDecodeError:
-                    log(f"Failed to decode JSON response: {response}")
-                    raise
+                    response = await client.query_async([
+                        {"role": "user", "content": json.dumps(batch_summaries)},
+                        {"role": "user", "content": prompt},
+                    ], on_token=on_token)
+                    log(f"response: {response}")
 
-                final_files.extend(batch_files)
+                    if not response:
+                        raise ValueError("Received empty response from ModelClient")
+                    if pending:
+                        raise ValueError(f"Response did not contain a usable entry for: {list(pending)}")
+                    break
 
-                # Update the set of all new paths
-                for file_info in batch_files:
-                    new_path = file_info["new_path"]
-                    new_dir = os.path.dirname(new_path)
-                    all_new_paths.add(new_dir)
+                except RetriesExhausted as e:
+                    # The limiter already backed off and retried; asking again right away won't help.
+                    log(f"Skipping the rest of batch {batch_number}: {e}")
+                    break
+                except Exception as e:
+                    if not pending:
+                        # The stream broke after every entry was already received
+                        break
+                    log(f"Attempt {attempt + 1}/{MAX_ATTEMPTS} for batch {batch_number} failed: {e}")
+            else:
+                log(f"Leaving {list(pending)} in place: no usable response after {MAX_ATTEMPTS} attempts")
 
-                done = True
+        async def commit(task, accepted):
+            # Entries of the oldest batch are committed (and moved) as they stream in, while later
+            # batches wait in their queues. Committing in batch order and model output order keeps
+            # collision suffixes independent of which call finishes first.
+            while (file_info := await accepted.get()) is not None:
+                await add_file(file_info)
+            await task
 
-                await notify_clients(task_id, {"event": "progress", "type": 2, "progress": f"{i + 1}/{len(summaries)}"})
+        def start_batch(batch_number, batch):
+            accepted = asyncio.Queue()
+            in_flight.append((asyncio.create_task(classify_batch(batch_number, batch, accepted)), accepted))
 
-            except Exception as e:
-                log(str(e))
+        # Phase 2: classify every file into the fixed taxonomy, several batches at a time
+        batch = []
+        batch_number = 0
+        for entry in staging.iter_file_summaries_for_planning():
+            batch.append(entry)
+            if len(batch) < CLASSIFY_BATCH_SIZE:
+                continue
+            start_batch(batch_number, batch)
+            batch = []
+            batch_number += 1
+            if len(in_flight) >= PARALLEL_BATCHES:
+                await commit(*in_flight.popleft())
+        if batch:
+            start_batch(batch_number, batch)
+        while in_flight:
+            await commit(*in_flight.popleft())
+
+        return final_files
+    finally:
+        for task, _ in in_flight:
+            task.cancel()
+        if own_staging:
+            staging.close()
 
-    return final_files
\ No newline at end of file
+async def iterate_summaries(summaries):
+    # Accepts lists, generators or async generators of FileSummary records (or plain dicts)
+    if hasattr(summaries, "__aiter__"):
+        async for summary in summaries:
+            yield summary if isinstance(summary, FileSummary) else FileSummary(summary["file_path"], summary["summary"])
+    else:
+        for summary in summaries:
+            yield summary if isinstance(summary, FileSummary) else FileSummary(summary["file_path"], summary["summary"])
@@ -0,0 +1,227 @@
+# walk_filter.py
+
+import os
+import re
+import time
+
+# Per-folder ignore files, read while walking. Their rules apply to the folder and everything below it.
+IGNORE_FILES = [".gitignore", ".llamafsignore"]
+
+# Folders that are never worth scanning
+DEFAULT_IGNORE_PATTERNS = [
+    ".git/",
+    ".hg/",
+    ".svn/",
+    "node_modules/",
+    "__pycache__/",
+    ".venv/",
+    "venv/",
+    ".tox/",
+    ".mypy_cache/",
+    ".pytest_cache/",
+    ".cache/",
+    ".Trash/",
+    ".llamafsignore",
+]
+
+class IgnoreRule:
+    __slots__ = ("base", "regex", "negate", "dir_only")
+
+    def __init__(self, base, regex, negate, dir_only):
+        self.base = base
+        self.regex = regex
+        self.negate = negate
+        self.dir_only = dir_only
+
+def translate_pattern(pattern: str) -> str:
+    """Translate a .gitignore glob into a regular expression over "/"-separated paths."""
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "(?:/.*)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                group = pattern[i + 1:end]
+                if group.startswith("!"):
+                    group = "^" + group[1:]
+                regex += f"[{group}]"
+                i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+def compile_rule(line: str, base: str):
+    """Compile one .gitignore line relative to the folder it applies to, or return None for blanks and comments."""
+    line = line.rstrip("\n\r")
+    if not line.strip() or line.startswith("#"):
+        return None
+    line = line.rstrip()
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # A slash anywhere but the end anchors the pattern to the folder; otherwise it matches at any depth.
+    anchored = "/" in line
+    regex = translate_pattern(line.lstrip("/"))
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return IgnoreRule(base, re.compile(f"^{regex}$"), negate, dir_only)
+
+def to_posix(path: str) -> str:
+    return os.path.abspath(path).replace("\\", "/").rstrip("/")
+
+class WalkFilter:
+    """
+    Decides during traversal which entries are visited, so pruned folders are never scanned.
+
+    Supports .gitignore style patterns (request-wide and per folder via IGNORE_FILES),
+    extension sets, size and age limits, and policies for symlinked folders and
+    mount boundaries. Rules are passed down the walk: directory_rules() returns the
+    rules for a folder's entries given the rules inherited from its parent.
+    """
+
+    def __init__(self, root: str, extensions=None, ignore_patterns=None, max_file_size=None,
+                 max_age_days=None, follow_symlinks=False, cross_mounts=False, exclude_hidden=False,
+                 ignore_files=IGNORE_FILES):
+        # Walked paths keep the root exactly as given, so callers can relate them to the path
+        # they passed in; the absolute "/"-separated form is only used to match ignore rules.
+        self.root = root
+        self.extensions = {ext.lower() if ext.startswith(".") else f".{ext.lower()}" for ext in extensions} if extensions else None
+        self.max_file_size = max_file_size
+        self.min_mtime = time.time() - max_age_days * 86400 if max_age_days else None
+        self.follow_symlinks = follow_symlinks
+        self.cross_mounts = cross_mounts
+        self.exclude_hidden = exclude_hidden
+        self.ignore_files = ignore_files or []
+        self.root_device = os.stat(root).st_dev
+        self.visited = set()
+
+        self.base_rules = []
+        for pattern in list(DEFAULT_IGNORE_PATTERNS) + list(ignore_patterns or []):
+            rule = compile_rule(pattern, to_posix(root))
+            if rule is not None:
+                self.base_rules.append(rule)
+
+    @classmethod
+    def from_options(cls, root: str, options: dict = None, default_extensions=None, exclude_hidden=False):
+        options = dict(options or {})
+        if options.get("extensions") is None:
+            options["extensions"] = default_extensions
+        return cls(
+            root,
+            extensions=options.get("extensions"),
+            ignore_patterns=options.get("ignore_patterns"),
+            max_file_size=options.get("max_file_size"),
+            max_age_days=options.get("max_age_days"),
+            follow_symlinks=bool(options.get("follow_symlinks")),
+            cross_mounts=bool(options.get("cross_mounts")),
+            exclude_hidden=exclude_hidden,
+        )
+
+    def directory_rules(self, directory: str, inherited=None) -> list:
+        rules = list(self.base_rules if inherited is None else inherited)
+        base = to_posix(directory)
+        for name in self.ignore_files:
+            try:
+                with open(os.path.join(directory, name), "r", encoding="utf-8", errors="replace") as ignore_file:
+                    for line in ignore_file:
+                        rule = compile_rule(line, base)
+                        if rule is not None:
+                            rules.append(rule)
+            except OSError:
+                continue
+        return rules
+
+    def is_ignored(self, path: str, is_dir: bool, rules) -> bool:
+        path = to_posix(path)
+        ignored = False
+        # Last matching rule wins, so later "!" patterns can re-include
+        for rule in rules:
+            if rule.dir_only and not is_dir:
+                continue
+            if not path.startswith(rule.base + "/"):
+                continue
+            if rule.regex.match(path[len(rule.base) + 1:]):
+                ignored = not rule.negate
+        return ignored
+
+    def enter_directory(self, path: str) -> bool:
+        # Guards against symlink loops when symlinked folders are followed
+        if not self.follow_symlinks:
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        key = (stat.st_dev, stat.st_ino)
+        if key in self.visited:
+            return False
+        self.visited.add(key)
+        return True
+
+    def include(self, entry: os.DirEntry, rules) -> bool:
+        if self.exclude_hidden and entry.name.startswith("."):
+            return False
+        try:
+            is_dir = entry.is_dir()
+            if is_dir and entry.is_symlink() and not self.follow_symlinks:
+                return False
+            if self.is_ignored(entry.path, is_dir, rules):
+                return False
+            if is_dir:
+                return self.cross_mounts or entry.stat().st_dev == self.root_device
+            if self.extensions is not None and os.path.splitext(entry.name)[1].lower() not in self.extensions:
+                return False
+            if self.max_file_size is not None or self.min_mtime is not None:
+                stat = entry.stat()
+                if self.max_file_size is not None and stat.st_size > self.max_file_size:
+                    return False
+                if self.min_mtime is not None and stat.st_mtime < self.min_mtime:
+                    return False
+            return True
+        except OSError:
+            return False
+
+    def iter_files(self, directory: str = None, inherited=None):
+        """Yield the paths of every included file below directory (the root by default)."""
+        directory = directory or self.root
+        if not self.enter_directory(directory):
+            return
+        rules = self.directory_rules(directory, inherited)
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            if not self.include(entry, rules):
+                continue
+            if entry.is_dir():
+                yield from self.iter_files(entry.path, rules)
+            else:
+                yield entry.path